@@ -9,6 +9,8 @@
 import kodo
 import re
 
+_SPLIT_RE = re.compile(r'([A-Z][a-z]*\d*)')
+
 """
 A Simplified API for kodo python.
 
@@ -39,36 +41,8 @@ Usage:
 """
 
 
-def nested_add(dictionary, keys, value):
-    current_dict = dictionary
-    for key in keys:
-        new_dict = {}
-        if key == keys[-1]:
-            current_dict[key] = value
-            continue
-        if key not in current_dict:
-            current_dict[key] = new_dict
-            current_dict = new_dict
-        else:
-            current_dict = current_dict[key]
-
-
-def nested_get(dictionary, keys):
-    current_dict = dictionary
-
-    for key in keys:
-        if key in current_dict:
-            value = current_dict[key]
-            if type(value) == dict:
-                current_dict = value
-            else:
-                return value
-        else:
-            raise KeyError("{} not found.".format(" ".join(keys)))
-
-
 def split_upper_case(s):
-    return [a for a in re.split(r'([A-Z][a-z]*\d*)', s) if a]
+    return list(filter(None, _SPLIT_RE.split(s)))
 
 
 def __get_stacks():
@@ -78,7 +52,8 @@ def __get_stacks():
     fields = []
 
     for stack in dir(kodo):
-        if stack.startswith('__'):
+        # Cheap checks first, only factories are split into pieces
+        if stack.startswith('__') or 'Factory' not in stack:
             continue
 
         stack_pieces = split_upper_case(stack)
@@ -106,31 +81,30 @@ def __get_stacks():
 
         location += [coder_type]
 
-        nested_add(
-            kodo_stacks,
-            location,
-            getattr(kodo, stack))
+        kodo_stacks[tuple(location)] = getattr(kodo, stack)
 
     return (kodo_stacks, algorithms, fields)
 
 
 __kodo_stacks, algorithms, fields = __get_stacks()
 
-for algorithm in algorithms:
-    globals()[algorithm] = algorithm
-
-for field in fields:
-    globals()[field] = field
+# Expose the algorithms and fields as module attributes, e.g. pykodo.binary8
+globals().update({algorithm: algorithm for algorithm in algorithms})
+globals().update({field: field for field in fields})
 
 
 def __create_factory(algorithm, coder_type, max_symbols,
                      max_symbol_size, field=None):
-    location = [algorithm]
     if field is not None:
-        location += [field]
-    location += [coder_type]
-
-    return nested_get(__kodo_stacks, location)(max_symbols, max_symbol_size)
+        location = (algorithm, field, coder_type)
+    else:
+        location = (algorithm, coder_type)
+
+    try:
+        stack = __kodo_stacks[location]
+    except KeyError:
+        raise KeyError("{} not found.".format(" ".join(location)))
+    return stack(max_symbols, max_symbol_size)
 
 
 def decoder_factory(**kwargs):
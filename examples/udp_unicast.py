@@ -6,16 +6,35 @@
 # See accompanying file LICENSE.rst or
 # http://www.steinwurf.com/licensing
 
+import errno
 import os
+import select
 import socket
-import time
 import sys
 
 import argparse
 import json
 
+try:
+    # Durations are measured with a monotonic clock where it is available
+    from time import monotonic as now
+except ImportError:
+    from time import time as now
+from time import sleep
+
+try:
+    # A faster C implementation of json, optional
+    import orjson
+except ImportError:
+    orjson = None
+
 import kodo
 
+# The acks are sent and received as raw bytes, so they are never encoded
+SENDING_ACK = b"settings OK, sending"
+RECEIVING_ACK = b"settings OK, receiving"
+STOP_ACK = b"Stop sending"
+
 
 def main():
     """
@@ -98,6 +117,13 @@ def main():
         help='maximum amount of redundancy to be sent, in percent.',
         default=200)
 
+    client_parser.add_argument(
+        '--packet-interval',
+        type=float,
+        help='time between sent packets, in seconds. Use 0 to send as fast '
+             'as possible.',
+        default=0.001)
+
     client_parser.add_argument(
         '--timeout',
         type=float,
@@ -121,12 +147,18 @@ def server(args):
     settings_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     settings_socket.bind(('', args.settings_port))
 
+    # How the server handles each direction requested by a client
+    handlers = {
+        'server_to_client': send_data,
+        'client_to_server': receive_data,
+    }
+
     # Wait for settings connections
     print("Server running, press ctrl+c to stop.")
     while True:
-        data, address = receive(settings_socket, 1024)
+        data, address = settings_socket.recvfrom(1024)
         try:
-            settings = json.loads(data)
+            settings = json_loads(data)
         except Exception:
             print("Settings message invalid.")
             continue
@@ -134,14 +166,13 @@ def server(args):
         settings['role'] = 'server'
         settings['client_ip'] = address[0]
 
-        if settings['direction'] == 'server_to_client':
-            send_data(settings, 'server')
-        elif settings['direction'] == 'client_to_server':
-            receive_data(settings, 'server')
-        else:
+        handler = handlers.get(settings.get('direction'))
+        if handler is None:
             print("Invalid direction.")
             continue
 
+        handler(settings, 'server')
+
 
 def client(args):
 
@@ -162,15 +193,41 @@ def client(args):
         send_data(settings, 'client')
 
 
+# The last factory built for each factory type, with its parameters
+factories = {}
+
+
+def get_factory(factory_type, settings):
+    """
+    Return a factory for the symbols and symbol size in the settings.
+
+    The last factory of each type is reused, so a server running repeated
+    tests with the same settings only builds it once. Only one factory per
+    type is kept, as the settings come from the clients.
+
+    :param factory_type: The kodo factory class to use.
+    :param settings: The settings of the test.
+    """
+    parameters = (settings['symbols'], settings['symbol_size'])
+    cached = factories.get(factory_type)
+    if cached is not None and cached[0] == parameters:
+        return cached[1]
+
+    factory = factory_type(
+        max_symbols=settings['symbols'],
+        max_symbol_size=settings['symbol_size'])
+    factories[factory_type] = (parameters, factory)
+    return factory
+
+
 def send_data(settings, role):
     """
     Send data to the other node
     """
 
     # Setup kodo encoder_factory and encoder
-    encoder_factory = kodo.FullVectorEncoderFactoryBinary(
-        max_symbols=settings['symbols'],
-        max_symbol_size=settings['symbol_size'])
+    encoder_factory = get_factory(
+        kodo.FullVectorEncoderFactoryBinary, settings)
 
     encoder = encoder_factory.build()
     data_in = os.urandom(encoder.block_size())
@@ -179,7 +236,9 @@ def send_data(settings, role):
     send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
     control_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    control_socket.settimeout(0.00000000000000000001)
+    # Non-blocking, so reading the ack never stalls the sender, even if
+    # select() reported a datagram that was then discarded
+    control_socket.setblocking(False)
 
     if role == 'client':
         address = (settings['server_ip'], settings['data_port'])
@@ -191,31 +250,59 @@ def send_data(settings, role):
             settings['server_ip'],
             settings['client_control_port'])
         control_socket.bind(('', settings['server_control_port']))
-        send(send_socket, "settings OK, sending", server_address)
+        send_socket.sendto(SENDING_ACK, server_address)
+
+    # Bind the methods used for every packet to locals
+    write_payload = encoder.write_payload
+    sendto = send_socket.sendto
+
+    # Read the settings once, rather than hashing the keys for every packet
+    symbols = settings['symbols']
+    max_packets = symbols * settings['max_redundancy'] / 100
+    # Older clients do not send an interval, they were paced at about 1 ms
+    packet_interval = settings.get('packet_interval', 0.001)
 
     sent = 0
-    start = time.time()
+    start = now()
     end = None
-    while sent < settings['symbols'] * settings['max_redundancy'] / 100:
-        packet = encoder.write_payload()
-        send(send_socket, packet, address)
+    while sent < max_packets:
+        # The payload is already bytes, so it can be sent directly
+        sendto(write_payload(), address)
         sent += 1
 
+        # The receiver cannot decode before it has one packet per symbol, so
+        # there is no ack to look for until then. After that the ack is
+        # checked for after every packet. Packets sent while the ack is in
+        # flight are still counted, so the overshoot is about one round trip
+        # divided by the packet interval.
+        if sent < symbols:
+            if packet_interval:
+                sleep(packet_interval)
+            continue
+
+        # Waiting for the ack until the next packet is due also paces the
+        # sender
+        ready, _, _ = select.select([control_socket], [], [], packet_interval)
+        if not ready:
+            continue
+
         try:
             control_socket.recv(1024)
-            if end is None:
-                end = time.time()
-            break
-        except socket.timeout:
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
             continue
 
+        end = now()
+        break
+
     # if no ack was received we sent all packets
     if end is None:
-        end = time.time()
+        end = now()
 
     control_socket.close()
 
-    size = encoder.block_size() * (float(sent) / settings['symbols'])
+    size = encoder.block_size() * (float(sent) / symbols)
     seconds = end - start
     print("Sent {0} packets, {1} kB, in {2}s, at {3:.2f} kb/s.".format(
         sent, size / 1000, seconds, size * 8 / 1000 / seconds))
@@ -225,9 +312,8 @@ def receive_data(settings, role):
     """Receive data from the other node"""
 
     # Setup kodo encoder_factory and decoder
-    decoder_factory = kodo.FullVectorDecoderFactoryBinary(
-        max_symbols=settings['symbols'],
-        max_symbol_size=settings['symbol_size'])
+    decoder_factory = get_factory(
+        kodo.FullVectorDecoderFactoryBinary, settings)
 
     decoder = decoder_factory.build()
 
@@ -243,31 +329,40 @@ def receive_data(settings, role):
         send_settings(settings)
     else:  # server
         address = (settings['client_ip'], settings['client_control_port'])
-        send(send_socket, "settings OK, receiving", address)
+        send_socket.sendto(RECEIVING_ACK, address)
+
+    # Bind the methods used for every packet to locals
+    recv = data_socket.recv
+    read_payload = decoder.read_payload
+    is_complete = decoder.is_complete
+    sendto = send_socket.sendto
+
+    # Leave room for the coding header on top of the symbol
+    packet_size = settings['symbol_size'] + 100
 
     # Decode coded packets
     received = 0
-    start = time.time()
+    start = now()
     end = None
     while 1:
         try:
-            packet = data_socket.recv(settings['symbol_size'] + 100)
+            packet = recv(packet_size)
 
-            if not decoder.is_complete():
-                decoder.read_payload(packet)
+            if not is_complete():
+                read_payload(packet)
                 received += 1
 
-            if decoder.is_complete():
+            if is_complete():
                 if end is None:
-                    end = time.time()  # stopping time once
-                send(send_socket, "Stop sending", address)
+                    end = now()  # stopping time once
+                sendto(STOP_ACK, address)
 
         except socket.timeout:
             break  # no more data arriving
 
     # in case we did not complete
     if end is None:
-        end = time.time()
+        end = now()
 
     data_socket.close()
 
@@ -297,54 +392,51 @@ def send_settings(settings):
     send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     send_address = (settings['server_ip'], settings['settings_port'])
 
-    message = json.dumps(settings)
+    # Encode once, the same message is resent until the server answers
+    message = to_bytes(json_dumps(settings))
     ack = None
     address = ''
     while ack is None:
         # Send settings
-        send(send_socket, message, send_address)
+        send_socket.sendto(message, send_address)
         # Waiting for respons
         try:
-            ack, address = receive(control_socket, 1024)  # Server ack
+            # Server ack, any answer will do so it is not decoded
+            ack, address = control_socket.recvfrom(1024)
         except socket.timeout:
             print("Timeout - server not responding to settings.")
 
     control_socket.close()
 
 
-def send(socket, message, address):
-    """
-    Send message to address using the provide socket.
-
-    Works for both python2 and python3
+# Pick the python2/python3 conversions once, rather than on every packet
+if sys.version_info[0] == 2:
+    def to_bytes(message):
+        return message
 
-    :param socket: The socket to use.
-    :param message: The message to send.
-    :param address: The address to send to.
-    """
-    if sys.version_info[0] == 2:
-        message = message
-    else:
+    def to_string(data):
+        return data
+else:
+    def to_bytes(message):
         if isinstance(message, str):
-            message = bytes(message, 'utf-8')
-    socket.sendto(message, address)
+            return message.encode('utf-8')
+        return message
 
+    def to_string(data):
+        if isinstance(data, bytes):
+            return data.decode('utf-8')
+        return data
 
-def receive(socket, number_of_bytes):
-    """
-    Receive an amount of bytes.
 
-    Works for both python2 and python3
+# orjson is used for the settings when available, it reads and writes bytes
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+else:
+    def json_loads(data):
+        return json.loads(to_string(data))
 
-    :param socket: The socket to use.
-    :param number_of_bytes: The number of bytes to receive.
-    """
-    data, address = socket.recvfrom(number_of_bytes)
-    if sys.version_info[0] == 2:
-        return data, address
-    else:
-        if isinstance(data, bytes):
-            return str(data, 'utf-8'), address
+    json_dumps = json.dumps
 
 if __name__ == "__main__":
     main()
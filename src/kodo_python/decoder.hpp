@@ -21,6 +21,7 @@
 
 #include "coder.hpp"
 #include "resolve_field_name.hpp"
+#include "write_payload_bytes.hpp"
 
 namespace kodo_python
 {
@@ -43,14 +44,7 @@ namespace kodo_python
     template<class Decoder>
     PyObject* decoder_write_payload(Decoder& decoder)
     {
-        std::vector<uint8_t> payload(decoder.payload_size());
-        auto length = decoder.write_payload(payload.data());
-
-        #if PY_MAJOR_VERSION >= 3
-        return PyBytes_FromStringAndSize((char*)payload.data(), length);
-        #else
-        return PyString_FromStringAndSize((char*)payload.data(), length);
-        #endif
+        return write_payload_bytes(decoder);
     }
 
     template<class Decoder>
@@ -6,7 +6,6 @@
 #pragma once
 
 #include <string>
-#include <vector>
 
 #include <Python.h>
 #include <bytesobject.h>
@@ -17,6 +16,7 @@
 
 #include "coder.hpp"
 #include "resolve_field_name.hpp"
+#include "write_payload_bytes.hpp"
 
 namespace kodo_python
 {
@@ -39,13 +39,7 @@ namespace kodo_python
     template<class Encoder>
     PyObject* encoder_write_payload(Encoder& encoder)
     {
-        std::vector<uint8_t> payload(encoder.payload_size());
-        uint32_t length = encoder.write_payload(payload.data());
-        #if PY_MAJOR_VERSION >= 3
-        return PyBytes_FromStringAndSize((char*)payload.data(), length);
-        #else
-        return PyString_FromStringAndSize((char*)payload.data(), length);
-        #endif
+        return write_payload_bytes(encoder);
     }
 
     template<bool IsSystematicEncoder>
@@ -0,0 +1,67 @@
+// Copyright Steinwurf ApS 2015.
+// Distributed under the "STEINWURF RESEARCH LICENSE 1.0".
+// See accompanying file LICENSE.rst or
+// http://www.steinwurf.com/licensing
+
+#pragma once
+
+#include <cstdint>
+
+#include <Python.h>
+#include <bytesobject.h>
+#include <boost/python.hpp>
+
+namespace kodo_python
+{
+    // Write a payload directly into a new bytes object, which is then shrunk
+    // to the actual payload length. This avoids allocating and copying an
+    // intermediate buffer for every payload.
+    template<class Coder>
+    PyObject* write_payload_bytes(Coder& coder)
+    {
+        #if PY_MAJOR_VERSION >= 3
+        PyObject* payload =
+            PyBytes_FromStringAndSize(nullptr, coder.payload_size());
+        #else
+        PyObject* payload =
+            PyString_FromStringAndSize(nullptr, coder.payload_size());
+        #endif
+
+        if (payload == nullptr)
+        {
+            boost::python::throw_error_already_set();
+        }
+
+        uint32_t length = 0;
+        try
+        {
+            #if PY_MAJOR_VERSION >= 3
+            length = coder.write_payload(
+                (uint8_t*)PyBytes_AS_STRING(payload));
+            #else
+            length = coder.write_payload(
+                (uint8_t*)PyString_AS_STRING(payload));
+            #endif
+        }
+        catch (...)
+        {
+            // Release the bytes object, or it leaks when the coder throws
+            Py_DECREF(payload);
+            throw;
+        }
+
+        // On failure the resize releases the object and sets it to nullptr
+        #if PY_MAJOR_VERSION >= 3
+        int result = _PyBytes_Resize(&payload, length);
+        #else
+        int result = _PyString_Resize(&payload, length);
+        #endif
+
+        if (result < 0)
+        {
+            boost::python::throw_error_already_set();
+        }
+
+        return payload;
+    }
+}